@@ -184,18 +184,18 @@ class LineFollower:
              # 0 0 1 - Left and Center see black -> Trolley is too far right
              # Need slight left correction
              return LINE_SLIGHT_RIGHT
-        #elif left_sensor and left_sensor and left_sensor:
+        #elif left_sensor and center_sensor and right_sensor:
              # 1 1 1 - All sensors see white -> Completely off the line
              #return LINE_LOST
         elif not left_sensor and not center_sensor and not right_sensor:
             # 0 0 0 - All sensors see black -> Could be over a junction mark or very wide line.
              # print("Warning: All sensors on black (0 0 0). Assuming centered.")
              return LINE_CENTERED # Treat as centered to keep moving over potential marks.
-        elif not left_sensor and left_sensor and left_sensor:
+        elif not left_sensor and center_sensor and right_sensor:
              # 0 1 1 - Sharp left deviation (Only Left sensor sees black)
              # Need slight left correction (from trolley's perspective)
              return LINE_SLIGHT_RIGHT # Return state indicating trolley is too far right
-        elif left_sensor and left_sensor and not right_sensor:
+        elif left_sensor and center_sensor and not right_sensor:
              # 1 1 0 - Sharp right deviation (Only Right sensor sees black)
              # Need slight right correction (from trolley's perspective)
              return LINE_SLIGHT_LEFT # Return state indicating trolley is too far left
@@ -177,7 +177,7 @@ class LineFollower:
              # 0 0 1 - Left and Center see black -> Trolley is too far right
              return LINE_SLIGHT_RIGHT
         # --- LINE LOST Condition 1 (Commented Out) ---
-        # elif left_sensor and left_sensor and left_sensor:
+        # elif left_sensor and center_sensor and right_sensor:
         #      # 1 1 1 - All sensors see white -> Completely off the line
         #      # return LINE_LOST
         #      pass # Fall through or default? Defaulting to CENTERED might be risky if truly lost.
@@ -185,10 +185,10 @@ class LineFollower:
             # 0 0 0 - All sensors see black -> Could be over a junction mark or very wide line.
              # print("Warning: All sensors on black (0 0 0). Assuming centered.")
              return LINE_CENTERED # Treat as centered to keep moving over potential marks.
-        elif not left_sensor and left_sensor and left_sensor:
+        elif not left_sensor and center_sensor and right_sensor:
              # 0 1 1 - Sharp left deviation (Only Left sensor sees black)
              return LINE_SLIGHT_RIGHT # Needs correction towards the line (left)
-        elif left_sensor and left_sensor and not right_sensor:
+        elif left_sensor and center_sensor and not right_sensor:
              # 1 1 0 - Sharp right deviation (Only Right sensor sees black)
              return LINE_SLIGHT_LEFT # Needs correction towards the line (right)
         # --- LINE LOST Condition 2 (Commented Out) ---
@@ -167,14 +167,14 @@ class LineFollower:
         elif not left_sensor and not center_sensor and right_sensor: # 0 0 1
              return LINE_SLIGHT_RIGHT # Robot is RIGHT, needs LEFT correction (M)
         # --- LINE LOST Condition 1 (Commented Out) ---
-        # elif left_sensor and left_sensor and left_sensor: # 1 1 1
+        # elif left_sensor and center_sensor and right_sensor: # 1 1 1
         #      # return LINE_LOST
         #      pass
         elif not left_sensor and not center_sensor and not right_sensor: # 0 0 0
              return LINE_CENTERED # Assume junction or wide line
-        elif not left_sensor and left_sensor and left_sensor: # 0 1 1
+        elif not left_sensor and center_sensor and right_sensor: # 0 1 1
              return LINE_SLIGHT_RIGHT # Sharp Left deviation -> Needs LEFT correction (M)
-        elif left_sensor and left_sensor and not right_sensor: # 1 1 0
+        elif left_sensor and center_sensor and not right_sensor: # 1 1 0
              return LINE_SLIGHT_LEFT # Sharp Right deviation -> Needs RIGHT correction (N)
         # --- LINE LOST Condition 2 (Commented Out) ---
         # else: # Catches remaining cases like 0 1 0
@@ -1,4 +1,5 @@
 import time
+import threading
 import lgpio
 
 # --- HC-SR04 Ultrasonic Sensor Pins (Raspberry Pi) ---
@@ -11,38 +12,50 @@ h = lgpio.gpiochip_open(0)  # Open the default GPIO chip
 
 # --- Set Pin Modes using lgpio ---
 lgpio.gpio_claim_output(h, TRIG_PIN, 0)  # Set initial state to LOW
-lgpio.gpio_claim_input(h, ECHO_PIN)  # Echo is an input
+lgpio.gpio_claim_alert(h, ECHO_PIN, lgpio.BOTH_EDGES)  # Echo is an input, reported by edge
 lgpio.gpio_claim_output(h, BUZZER_PIN, 0)  # Initially buzzer off
 
+# --- Echo edge timing ---
+# The kernel timestamps each echo edge (ns), so the pulse width no longer
+# depends on how fast Python can poll the pin.
+echo_rise_ns = None
+echo_width_ns = None
+echo_done = threading.Event()
+
+
+def on_echo_edge(chip, gpio, level, tick):
+    global echo_rise_ns, echo_width_ns
+    if level == 1:
+        echo_rise_ns = tick
+    elif level == 0 and echo_rise_ns is not None:
+        echo_width_ns = tick - echo_rise_ns
+        echo_done.set()
+
+
+echo_cb = lgpio.callback(h, ECHO_PIN, lgpio.BOTH_EDGES, on_echo_edge)
+
 
 def get_distance():
     """Measures distance using the HC-SR04 ultrasonic sensor."""
+    global echo_rise_ns, echo_width_ns
     # Ensure trigger is LOW
     lgpio.gpio_write(h, TRIG_PIN, 0)
     time.sleep(0.1)
 
+    echo_rise_ns = None
+    echo_width_ns = None
+    echo_done.clear()
+
     # Send 10us pulse
     lgpio.gpio_write(h, TRIG_PIN, 1)
     time.sleep(0.00001)
     lgpio.gpio_write(h, TRIG_PIN, 0)
 
-    # Measure pulse width
-    pulse_start = time.time()
-    pulse_end = time.time()
-
-    timeout_start = time.time()
-    while lgpio.gpio_read(h, ECHO_PIN) == 0:
-        pulse_start = time.time()
-        if pulse_start - timeout_start > 0.02:  # Timeout
-            return -1
-
-    timeout_start = time.time()
-    while lgpio.gpio_read(h, ECHO_PIN) == 1:
-        pulse_end = time.time()
-        if pulse_end - timeout_start > 0.02:  # Timeout
-            return -1
+    # Wait for the falling echo edge (covers both the rise and the pulse itself)
+    if not echo_done.wait(0.04):  # Timeout
+        return -1
 
-    pulse_duration = pulse_end - pulse_start
+    pulse_duration = echo_width_ns * 1e-9
     distance = pulse_duration * 17150
     distance = round(distance, 2)
     return distance
@@ -70,6 +83,7 @@ def main():
     except KeyboardInterrupt:
         print("Measurement stopped by user")
     finally:
+        echo_cb.cancel()
         lgpio.gpiochip_close(h)  # Clean up lgpio on exit
 
 
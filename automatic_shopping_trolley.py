@@ -1,9 +1,9 @@
 # -*- coding: utf-8 -*-
 """
 Raspberry Pi Controller for Automated Shopping Trolley (Refactored Version)
-... (Includes sensor print for debugging line following) ...
+... (Sensor trace for debugging line following is logged at DEBUG, TROLLEY_DEBUG=1) ...
 - Turn logic now stops when *any* sensor detects the new line.
-- NOTE: LINE_LOST logic is currently commented out in LineFollower.
+- NOTE: LINE_LOST is currently disabled in LineFollower's state table.
 """
 
 import firebase_admin
@@ -11,23 +11,45 @@ from firebase_admin import credentials, db
 import time
 import serial
 import lgpio
+import select
+import threading
+import queue
+import signal
 import sys # For exiting
+import os
+import json
+import logging
+from logging.handlers import MemoryHandler, RotatingFileHandler
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+log = logging.getLogger("trolley")
 
 # --- Constants ---
-# Commands for ESP32
-CMD_FORWARD = 'F'
-CMD_BACKWARD = 'B'
-CMD_STOP = 'S'
-CMD_LEFT = 'L'  # Turn left (pivot)
-CMD_RIGHT = 'R' # Turn right (pivot)
-CMD_SLIGHT_LEFT = 'M'  # ESP32's command for slight left correction (Veer Left)
-CMD_SLIGHT_RIGHT = 'N' # ESP32's command for slight right correction (Veer Right)
+# Commands for ESP32 (pre-encoded; written to the serial port as-is)
+CMD_FORWARD = b'F'
+CMD_BACKWARD = b'B'
+CMD_STOP = b'S'
+CMD_LEFT = b'L'  # Turn left (pivot)
+CMD_RIGHT = b'R' # Turn right (pivot)
+CMD_SLIGHT_LEFT = b'M'  # ESP32's command for slight left correction (Veer Left)
+CMD_SLIGHT_RIGHT = b'N' # ESP32's command for slight right correction (Veer Right)
 
 # Line Follower States (Returned by LineFollower class)
 LINE_CENTERED = "CENTERED"
 LINE_SLIGHT_LEFT = "SLIGHT_LEFT"   # Trolley is too far left, needs right correction (N)
 LINE_SLIGHT_RIGHT = "SLIGHT_RIGHT" # Trolley is too far right, needs left correction (M)
-LINE_LOST = "LOST" # NOTE: Logic returning this state is commented out below
+LINE_LOST = "LOST" # NOTE: Not returned while LINE_LOST handling is disabled
+
+# Trolley status strings (written to /trolleyStatus/<request_id>, read by the app)
+# Kept as plain "name[:arg...]" strings: the app parses these exact values, so the
+# wire format can only change together with the app.
+#   processing_list, processing_row:<n>, moving_to:<node>, moving_to_product:<pid>,
+#   reversing_to:<node>, arrived_at:<node>, waiting_for_item:<pid>:<name>,
+#   item_added:<pid>, waiting_for_home_confirmation, returning_home,
+#   completed, completed_empty_cart, error:<reason>[:<detail>]
+# Statuses that end a request, need attention, or prompt the user are written without coalescing delay
+URGENT_STATUS_PREFIXES = ("error:", "completed", "arrived_at:home", "waiting_for_")
 
 # GPIO Pins (Configuration) - *** VERIFY THESE MATCH YOUR WIRING ***
 IR_PIN_LEFT = 27
@@ -37,11 +59,20 @@ IR_PIN_RIGHT = 23
 # Serial Port (Configuration) - *** VERIFY THIS PORT NAME ***
 SERIAL_PORT = "/dev/ttyUSB0"
 SERIAL_BAUD = 115200
+SERIAL_RX_BUFFER_LIMIT = 4096 # Bytes of unterminated input kept before the oldest are dropped
+ESP32_READY_BANNER = b"READY" # Printed by the ESP32 once it has booted
+ESP32_BOOT_TIMEOUT = 2.0 # Seconds to wait for the banner; older firmware without one gets the old fixed 2 s wait
 
 # Firebase (Configuration) - *** VERIFY PATH & URL ***
 FIREBASE_CRED_PATH = "/home/pie/shopping_trolley/serviceAccountKey.json" # Use absolute path
 FIREBASE_DB_URL = 'https://shopping-trolley-6f99a-default-rtdb.asia-southeast1.firebasedatabase.app'
 
+# Logging (Configuration) - WARNING by default, set TROLLEY_DEBUG=1 for DEBUG
+LOG_FILE_PATH = "/home/pie/shopping_trolley/trolley.log"
+
+# Last known product names / tag UIDs, so a restart can start without waiting on Firebase
+CATALOG_CACHE_PATH = "/home/pie/shopping_trolley/catalog_cache.json"
+
 # Node Mapping (Easier Reference) - *** VERIFY AGAINST FIREBASE /products ***
 NODE_MAPPING = {
     "home": 0,
@@ -60,6 +91,64 @@ PRODUCT_ROWS = {
     "pdt4": 2, "pdt5": 2, "pdt6": 2,
     "pdt7": 3, "pdt8": 3, "pdt9": 3,
 }
+# Each row's products in the order the trolley passes them
+PRODUCT_ORDER_IN_ROW = {
+    row: sorted((pid for pid, r in PRODUCT_ROWS.items() if r == row), key=NODE_MAPPING.__getitem__)
+    for row in sorted(set(PRODUCT_ROWS.values())) # Rows in visiting order too
+}
+
+# Node kinds and rows, precomputed so navigation decisions don't re-parse node names
+NODE_KIND_HOME = 0
+NODE_KIND_RFJ = 1 # Row front junction
+NODE_KIND_RBJ = 2 # Row back junction
+NODE_KIND_PDT = 3 # Product
+
+class NodeInfo(NamedTuple):
+    name: str
+    kind: int
+    row: int # 0 for home
+
+def _build_node_info(name):
+    if name == "home":
+        return NodeInfo(name, NODE_KIND_HOME, 0)
+    if name.startswith("pdt"):
+        return NodeInfo(name, NODE_KIND_PDT, PRODUCT_ROWS[name])
+    kind = NODE_KIND_RFJ if name.startswith("RFJ") else NODE_KIND_RBJ
+    return NodeInfo(name, kind, int(name[3:]))
+
+NODE_INFO = {name: _build_node_info(name) for name in NODE_MAPPING}
+
+# Initial turn before driving off, by (start kind, end kind); missing pairs drive straight (FWD)
+TURN_BY_KIND = {
+    (NODE_KIND_HOME, NODE_KIND_RFJ): None,      # home->RFJ = FWD
+    (NODE_KIND_RFJ, NODE_KIND_PDT): CMD_RIGHT,  # RFJ->pdt = RIGHT
+    (NODE_KIND_RBJ, NODE_KIND_RFJ): CMD_RIGHT,  # RBJ->RFJ = RIGHT
+    (NODE_KIND_RBJ, NODE_KIND_RBJ): CMD_LEFT,   # RBJ->RBJ = LEFT
+    (NODE_KIND_RFJ, NODE_KIND_HOME): CMD_RIGHT, # RFJ->home = RIGHT
+}
+# ...expanded to every (start node, end node) pair that needs a turn
+TURN_FOR_TRANSITION = {
+    (start.name, end.name): TURN_BY_KIND[start.kind, end.kind]
+    for start in NODE_INFO.values() for end in NODE_INFO.values()
+    if TURN_BY_KIND.get((start.kind, end.kind))
+}
+
+def configure_logging():
+    """Sets up buffered file logging (plus console) for the trolley logger."""
+    level = logging.DEBUG if os.environ.get("TROLLEY_DEBUG") == "1" else logging.WARNING
+    formatter = logging.Formatter("%(asctime)s %(levelname)s %(message)s")
+    file_handler = RotatingFileHandler(LOG_FILE_PATH, maxBytes=1_000_000, backupCount=3, delay=True)
+    file_handler.setFormatter(formatter)
+    # Batch file writes; ERROR and above are written out immediately
+    buffered_handler = MemoryHandler(capacity=100, flushLevel=logging.ERROR, target=file_handler)
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+    log.setLevel(level)
+    log.addHandler(buffered_handler)
+    log.addHandler(console_handler)
+
+# IR sensor word (bit0=L, bit1=C, bit2=R) while a turn is still searching for the new line
+TURN_SEARCHING_BITS = 0b100
 
 # --- Hardware Abstraction ---
 class HardwareInterface:
@@ -67,121 +156,292 @@ class HardwareInterface:
     def __init__(self, serial_port, baud_rate, ir_left, ir_center, ir_right):
         self.h_gpio = None
         self.esp32 = None
+        self._poller = None
+        self._rx_buf = bytearray() # Bytes received from the ESP32 but not yet split into lines
         self.ir_pins = {'left': ir_left, 'center': ir_center, 'right': ir_right}
+        self._last_cmd = None # Last command the ESP32 is known to be executing
+        self._tx_lock = threading.Lock() # Commands come from both the navigator and the line follower thread
 
         try:
             self.h_gpio = lgpio.gpiochip_open(0)
-            lgpio.gpio_claim_input(self.h_gpio, self.ir_pins['left'])
-            lgpio.gpio_claim_input(self.h_gpio, self.ir_pins['center'])
-            lgpio.gpio_claim_input(self.h_gpio, self.ir_pins['right'])
-            print("GPIO initialized.")
+            # Claim the IR pins as one group (left is the group leader) so a
+            # single group_read returns all three levels: bit0=L, bit1=C, bit2=R
+            lgpio.group_claim_input(self.h_gpio, [ir_left, ir_center, ir_right])
+            log.info("GPIO initialized.")
         except Exception as e:
-            print(f"FATAL: Failed to initialize GPIO: {e}")
+            log.critical("Failed to initialize GPIO: %s", e)
             self.close() # Attempt cleanup even if partial init failed
             raise RuntimeError("GPIO Initialization Failed") from e
 
         try:
             self.esp32 = serial.Serial(serial_port, baud_rate, timeout=0.1) # Shorter timeout
-            print(f"Attempting connection to ESP32 on {serial_port}...")
-            time.sleep(2) # Allow ESP32 to reset and boot
+            log.info("Attempting connection to ESP32 on %s...", serial_port)
+            self._poller = select.poll() # Wake on incoming bytes instead of polling in_waiting
+            self._poller.register(self.esp32.fileno(), select.POLLIN)
+            if self._wait_for_banner(ESP32_READY_BANNER, ESP32_BOOT_TIMEOUT): # Allow ESP32 to reset and boot
+                log.info("ESP32 reported ready.")
+            else:
+                log.warning("No ready banner from ESP32 after %ss; assuming it has booted.", ESP32_BOOT_TIMEOUT)
             self.esp32.reset_input_buffer() # Clear any startup messages
-            print(f"Connected to ESP32 on {serial_port}")
+            self._rx_buf.clear()
+            try: self.esp32.set_low_latency_mode(True) # ASYNC_LOW_LATENCY: skip the USB-serial latency timer
+            except (AttributeError, OSError, ValueError) as e: log.warning("Serial low-latency mode unavailable: %s", e)
+            log.info("Connected to ESP32 on %s", serial_port)
         except serial.SerialException as e:
-            print(f"FATAL: Failed to connect to ESP32: {e}")
+            log.critical("Failed to connect to ESP32: %s", e)
             self.close() # Cleanup GPIO if serial failed
             raise RuntimeError("ESP32 Connection Failed") from e
 
-    def read_ir_sensors(self):
-        """Reads the state of the IR sensors."""
+    def _wait_for_banner(self, banner, timeout):
+        """Reads boot output until banner appears (True) or timeout seconds pass (False)."""
+        deadline = time.monotonic() + timeout
+        seen = bytearray()
+        while banner not in seen:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._poller.poll(remaining * 1000):
+                return False
+            seen += self.esp32.read(self.esp32.in_waiting or 1)
+            del seen[:-SERIAL_RX_BUFFER_LIMIT] # Only the tail can still contain the banner
+        return True
+
+    def read_ir_bits(self):
+        """Reads all IR sensors in one call as the raw group word: bit0=L, bit1=C, bit2=R."""
         # Assumes sensor logic: 0 = Black/On Line, 1 = White/Off Line
         try:
-            left = lgpio.gpio_read(self.h_gpio, self.ir_pins['left'])
-            center = lgpio.gpio_read(self.h_gpio, self.ir_pins['center'])
-            right = lgpio.gpio_read(self.h_gpio, self.ir_pins['right'])
-            return (left, center, right)
+            _, bits = lgpio.group_read(self.h_gpio, self.ir_pins['left'])
+            return bits & 0b111
+        except Exception as e:
+            log.error("Error reading IR sensors: %s", e)
+            return 0b111 # Return 'off line' state as a failsafe?
+
+    def read_ir_sensors(self):
+        """Reads the state of the IR sensors as (left, center, right)."""
+        bits = self.read_ir_bits()
+        return (bits & 1, (bits >> 1) & 1, (bits >> 2) & 1)
+
+    def wait_for_ir_change(self, idle_bits, timeout):
+        """
+        Blocks until the IR sensor word differs from idle_bits, or timeout seconds pass.
+        The pins are switched to kernel edge alerts for the wait, so it wakes on the edge
+        itself instead of a sleep/poll loop. Returns the new word, or None on timeout.
+        """
+        changed = threading.Event()
+        pins = (self.ir_pins['left'], self.ir_pins['center'], self.ir_pins['right'])
+        callbacks = []
+        poll_interval = None # Edges wake us; no polling needed
+        try:
+            lgpio.group_free(self.h_gpio, pins[0])
+            for pin in pins:
+                lgpio.gpio_claim_alert(self.h_gpio, pin, lgpio.BOTH_EDGES)
+                callbacks.append(lgpio.callback(self.h_gpio, pin, lgpio.BOTH_EDGES, lambda *_: changed.set()))
+            read_bits = lambda: sum(lgpio.gpio_read(self.h_gpio, pin) << i for i, pin in enumerate(pins))
+        except Exception as e:
+            log.warning("IR edge alerts unavailable, polling instead: %s", e)
+            self._release_ir_alerts(pins, callbacks)
+            read_bits, poll_interval = self.read_ir_bits, 0.05
+
+        try:
+            deadline = time.monotonic() + timeout
+            while True:
+                changed.clear() # Clear before reading so an edge during the read still wakes us
+                bits = read_bits()
+                if bits != idle_bits:
+                    return bits
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                changed.wait(remaining if poll_interval is None else min(remaining, poll_interval))
+        except Exception as e:
+            log.error("Error waiting on IR sensors: %s", e)
+            return None
+        finally:
+            if poll_interval is None:
+                self._release_ir_alerts(pins, callbacks)
+
+    def _release_ir_alerts(self, pins, callbacks):
+        """Cancels the edge alerts and puts the IR pins back into their read group."""
+        for cb in callbacks:
+            cb.cancel()
+        for pin in pins:
+            try: lgpio.gpio_free(self.h_gpio, pin)
+            except Exception: pass # Never claimed as an alert
+        try:
+            lgpio.group_claim_input(self.h_gpio, list(pins))
         except Exception as e:
-            print(f"Error reading IR sensors: {e}")
-            return (1, 1, 1) # Return 'off line' state as a failsafe?
+            log.error("Failed to reclaim IR sensor group: %s", e)
 
-    def send_command(self, command):
-        """Sends a single character command to the ESP32."""
+    def send_command(self, command, force=False):
+        """
+        Sends a single byte command (one of the CMD_* constants) to the ESP32 immediately.
+        A command the ESP32 is already executing is skipped unless force is set
+        (use force for safety STOPs, where the tracked state must not be trusted).
+        """
+        with self._tx_lock:
+            if command == self._last_cmd and not force:
+                return
+            # log.debug("Sending: %s", command) # Uncomment for detailed debug
+            if self.esp32 and self.esp32.is_open:
+                try:
+                    self.esp32.write(command) # No tcdrain; the kernel sends commands in order
+                    self._last_cmd = command
+                except serial.SerialException as e:
+                    log.error("Error sending command '%s': %s", command.decode('ascii'), e)
+                    self._last_cmd = None # ESP32 state unknown, don't skip the next command
+            else:
+                log.warning("ESP32 not connected. Cannot send command.")
+                self._last_cmd = None
+
+    def note_tag_stop(self):
+        """Records that the ESP32 halted itself on a tag read, so the next drive command is not skipped."""
+        with self._tx_lock:
+            self._last_cmd = CMD_STOP
+
+    def receive_line(self, wait_ms=0):
+        """
+        Reads a line from the ESP32, returns None if timeout/error/empty.
+        Blocks for up to wait_ms waiting for data to arrive (0 = don't wait).
+        """
         if self.esp32 and self.esp32.is_open:
             try:
-                # print(f"Sending: {command}") # Uncomment for detailed debug
-                self.esp32.write(command.encode('utf-8'))
-                self.esp32.flush() # Ensure data is sent immediately
+                line = self._next_buffered_line()
+                if line is None and self._poller.poll(wait_ms):
+                    # Drain whatever is pending in one read rather than readline()'s byte-at-a-time loop
+                    self._rx_buf += self.esp32.read(self.esp32.in_waiting or 1)
+                    if len(self._rx_buf) > SERIAL_RX_BUFFER_LIMIT: # Noise without newlines; don't grow forever
+                        del self._rx_buf[:-SERIAL_RX_BUFFER_LIMIT]
+                    line = self._next_buffered_line()
+                # if line: log.debug("Received: %s", line) # Uncomment for debug
+                return line
             except serial.SerialException as e:
-                print(f"Error sending command '{command}': {e}")
-        else:
-            print("Warning: ESP32 not connected. Cannot send command.")
+                log.error("Error receiving data: %s", e)
+        return None
 
-    def receive_line(self):
-        """Reads a line from the ESP32, returns None if timeout/error/empty."""
-        if self.esp32 and self.esp32.is_open:
+    def _next_buffered_line(self):
+        """Pops the next complete, non-empty line from the receive buffer (None if there isn't one)."""
+        while True:
+            end = self._rx_buf.find(b'\n')
+            if end < 0:
+                return None
+            line_bytes = bytes(self._rx_buf[:end])
+            del self._rx_buf[:end + 1]
             try:
-                if self.esp32.in_waiting > 0:
-                    line_bytes = self.esp32.readline()
-                    line = line_bytes.decode('utf-8').strip()
-                    if line:
-                        # print(f"Received: {line}") # Uncomment for debug
-                        return line
-            except serial.SerialException as e:
-                print(f"Error receiving data: {e}")
+                line = line_bytes.decode('utf-8').strip()
             except UnicodeDecodeError as e:
-                print(f"Serial decode error: {e} - Received bytes: {line_bytes}")
-        return None
+                log.error("Serial decode error: %s - Received bytes: %s", e, line_bytes)
+                continue
+            if line:
+                return line
 
     def close(self):
         """Cleans up resources."""
-        print("Closing hardware interface...")
+        log.info("Closing hardware interface...")
         if self.esp32 and self.esp32.is_open:
             try:
-                self.send_command(CMD_STOP)
-                time.sleep(0.1)
+                self.send_command(CMD_STOP, force=True)
+                self.esp32.flush() # Drain the STOP out of the UART before closing
                 self.esp32.close()
-                print("Serial port closed.")
+                log.info("Serial port closed.")
             except serial.SerialException as e:
-                 print(f"Error closing serial port: {e}")
+                 log.error("Error closing serial port: %s", e)
         if self.h_gpio is not None:
             try:
                 lgpio.gpiochip_close(self.h_gpio)
-                print("GPIO chip closed.")
+                log.info("GPIO chip closed.")
             except Exception as e:
-                 print(f"Error closing GPIO chip: {e}")
+                 log.error("Error closing GPIO chip: %s", e)
         self.h_gpio = None
         self.esp32 = None
 
-# --- Line Following Logic (LINE_LOST COMMENTED OUT) ---
+# --- Line Following Logic (LINE_LOST DISABLED) ---
 class LineFollower:
     """Interprets sensor readings to determine line state."""
 
+    # Indexed by the 3-bit sensor word (L << 2) | (C << 1) | R
+    # Assumes: 0 = Black/On Line, 1 = White/Off Line
+    _STATE_TABLE = (
+        LINE_CENTERED,     # 0 0 0 - Assume junction or wide line
+        LINE_SLIGHT_RIGHT, # 0 0 1 - Robot is RIGHT, needs LEFT correction (M)
+        LINE_CENTERED,     # 0 1 0 - Unusual, would be LINE_LOST
+        LINE_SLIGHT_RIGHT, # 0 1 1 - Sharp Left deviation -> Needs LEFT correction (M)
+        LINE_SLIGHT_LEFT,  # 1 0 0 - Robot is LEFT, needs RIGHT correction (N)
+        LINE_CENTERED,     # 1 0 1 - On the line
+        LINE_SLIGHT_LEFT,  # 1 1 0 - Sharp Right deviation -> Needs RIGHT correction (N)
+        LINE_CENTERED,     # 1 1 1 - All white, would be LINE_LOST
+    )
+
+    # The same table indexed by HardwareInterface.read_ir_bits() (bit0=L, bit1=C, bit2=R),
+    # the word the follower thread reads; only used to build COMMAND_BY_GROUP_BITS below
+    _STATE_BY_GROUP_BITS = tuple(map(_STATE_TABLE.__getitem__, (0, 4, 2, 6, 1, 5, 3, 7)))
+
+    # Drive command that corrects each state (LINE_LOST has none; keep the last command)
+    COMMAND_FOR_STATE = {
+        LINE_CENTERED: CMD_FORWARD,
+        LINE_SLIGHT_LEFT: CMD_SLIGHT_RIGHT,  # Robot is LEFT -> needs RIGHT correction (N)
+        LINE_SLIGHT_RIGHT: CMD_SLIGHT_LEFT,  # Robot is RIGHT -> needs LEFT correction (M)
+    }
+    # Both steps fused: read_ir_bits() word -> command (None = keep the last command)
+    COMMAND_BY_GROUP_BITS = tuple(map(COMMAND_FOR_STATE.get, _STATE_BY_GROUP_BITS))
+
     def get_state(self, left_sensor, center_sensor, right_sensor):
         """
         Determines the trolley's position relative to the line.
         Assumes: 0 = Black/On Line, 1 = White/Off Line
         Returns: State constant (e.g., LINE_CENTERED)
         """
-        if left_sensor and not center_sensor and right_sensor: # 1 0 1
-            return LINE_CENTERED
-        elif left_sensor and not center_sensor and not right_sensor: # 1 0 0
-             return LINE_SLIGHT_LEFT # Robot is LEFT, needs RIGHT correction (N)
-        elif not left_sensor and not center_sensor and right_sensor: # 0 0 1
-             return LINE_SLIGHT_RIGHT # Robot is RIGHT, needs LEFT correction (M)
-        # --- LINE LOST Condition 1 (Commented Out) ---
-        # elif left_sensor and left_sensor and left_sensor: # 1 1 1
-        #      # return LINE_LOST
-        #      pass
-        elif not left_sensor and not center_sensor and not right_sensor: # 0 0 0
-             return LINE_CENTERED # Assume junction or wide line
-        elif not left_sensor and left_sensor and left_sensor: # 0 1 1
-             return LINE_SLIGHT_RIGHT # Sharp Left deviation -> Needs LEFT correction (M)
-        elif left_sensor and left_sensor and not right_sensor: # 1 1 0
-             return LINE_SLIGHT_LEFT # Sharp Right deviation -> Needs RIGHT correction (N)
-        # --- LINE LOST Condition 2 (Commented Out) ---
-        # else: # Catches remaining cases like 0 1 0
-            # print(f"Warning: Unusual sensor state ({left_sensor}{center_sensor}{right_sensor}). Treating as LOST.")
-            # return LINE_LOST
-        return LINE_CENTERED # Default if LINE_LOST cases are commented
+        return self._STATE_TABLE[(left_sensor << 2) | (center_sensor << 1) | right_sensor]
+
+class LineFollowerThread(threading.Thread):
+    """
+    Steers along the line at its own cadence while armed, so waiting on the
+    serial port for RFID never delays a correction (and vice versa).
+    """
+    def __init__(self, hw_interface, line_follower, control_period):
+        super().__init__(name="line-follower", daemon=True)
+        self.hw = hw_interface
+        self.lf = line_follower
+        self.control_period = control_period
+        self._armed = threading.Event()
+        self._idle = threading.Event() # Set while no correction step can be in progress
+        self._idle.set()
+        self._shutdown = False
+
+    def arm(self):
+        """Starts line following."""
+        self._idle.clear()
+        self._armed.set()
+
+    def disarm(self):
+        """Stops line following; returns once no further command will be sent."""
+        self._armed.clear()
+        self._idle.wait()
+
+    def shutdown(self):
+        self._shutdown = True
+        self._armed.set() # Wake the thread so it can exit
+        self.join(timeout=1)
+
+    def run(self):
+        monotonic = time.monotonic
+        read_ir_bits = self.hw.read_ir_bits
+        send_command = self.hw.send_command
+        command_by_bits = self.lf.COMMAND_BY_GROUP_BITS
+        armed = self._armed
+        period = self.control_period
+        while True:
+            armed.wait()
+            if self._shutdown: return
+            next_tick = monotonic()
+            while armed.is_set() and not self._shutdown:
+                try:
+                    command = command_by_bits[read_ir_bits()] # None: keep the current command
+                    if command: send_command(command) # Repeats are dropped by the HardwareInterface
+                except Exception as e: log.error("Line follower step failed: %s", e)
+                # Resync after an overrun rather than bursting to catch up
+                next_tick += period
+                now = monotonic()
+                if next_tick <= now: next_tick = now + period
+                time.sleep(next_tick - now)
+            self._idle.set()
 
 # --- Firebase Communication ---
 class FirebaseComm:
@@ -192,69 +452,287 @@ class FirebaseComm:
             cred = credentials.Certificate(cred_path)
             firebase_admin.initialize_app(cred, {'databaseURL': db_url})
             self.db = db
-            print("Firebase initialized.")
+            self._last_status_by_req = {} # request_id -> last status written, to skip repeats
+            self._refs = {} # path parts -> db.Reference, so paths are only parsed once
+            self._name_cache = {} # product_id -> name; both caches are kept live by listeners (see _watch_catalog),
+            self._uid_cache = {} # node_name -> lowercased tag UID; misses and errors are not cached
+            self._missing_names = set() # Keys a full catalog read didn't have, so requests don't re-read it for them
+            self._missing_uids = set()
+            self._confirm_events = {} # request_id -> {flag name: threading.Event}
+            self._confirm_listeners = {} # request_id -> ListenerRegistration on trolleyConfirmations/<id>
+            # Status writes are fire-and-forget: the latest value per request waits in
+            # _pending_status and a single writer thread pushes everything pending
+            # to Firebase as one multi-path update.
+            self._pending_status = {}
+            self._pending_writes = {} # Other fire-and-forget writes (path -> value), sent with the next status batch
+            self._status_lock = threading.Lock()
+            self._status_queue = queue.Queue()
+            self._status_urgent = threading.Event() # Cuts the coalescing window short
+            self.status_coalesce_window = 0.2 # (s) Later updates within this window replace earlier ones
+            self._status_writer = threading.Thread(target=self._status_writer_loop, name="status-writer", daemon=True)
+            self._status_writer.start()
+            self._catalog_listeners = [] # Keep the caches in step with admin edits
+            self._snapshot_lock = threading.Lock()
+            log.info("Firebase initialized.")
+            self._catalog_closed = False
+            if self._load_catalog_snapshot(): # Serve the last known catalog now; read and listen off the startup path
+                threading.Thread(target=self._sync_catalog, name="catalog-sync", daemon=True).start()
+            else: self._sync_catalog()
         except Exception as e:
-            print(f"FATAL: Failed to initialize Firebase: {e}")
+            log.critical("Failed to initialize Firebase: %s", e)
             raise RuntimeError("Firebase Initialization Failed") from e
+    def _ref(self, *parts):
+        """Returns a cached reference to /part0/part1/..."""
+        ref = self._refs.get(parts)
+        if ref is None:
+            ref = self._refs[parts] = self.db.reference('/' + '/'.join(str(p) for p in parts))
+        return ref
+    def _evict_refs(self, request_id):
+        """Drops cached references belonging to a finished request."""
+        for parts in [k for k in list(self._refs) if len(k) > 1 and k[1] == request_id]: self._refs.pop(parts, None) # Other threads may add refs meanwhile
     def listen_for_requests(self, callback):
         try:
-            requests_ref = self.db.reference('/trolleyRequests')
+            requests_ref = self._ref('trolleyRequests')
             requests_ref.listen(callback)
-            print("Listening for Firebase requests...")
-        except Exception as e: print(f"Error starting Firebase listener: {e}")
-    def set_processing_status(self, request_id, status):
-        try: self.db.reference(f'/trolleyProcessing/{request_id}').set(status)
-        except Exception as e: print(f"Firebase Error: Could not set processing status for {request_id}: {e}")
-    def delete_processing_status(self, request_id):
-         try: self.db.reference(f'/trolleyProcessing/{request_id}').delete()
-         except Exception as e: print(f"Firebase Error: Could not delete processing status for {request_id}: {e}")
-    def is_processing(self, request_id):
-        try: return self.db.reference(f'/trolleyProcessing/{request_id}').get() is True
-        except Exception as e: print(f"Firebase Error: Could not check processing status for {request_id}: {e}"); return False
+            log.info("Listening for Firebase requests...")
+        except Exception as e: log.error("Error starting Firebase listener: %s", e)
+    def release_request(self, request_id):
+         """Drops per-request state once a request has finished."""
+         self.flush_status() # Final status lands before the request is released
+         self._last_status_by_req.pop(request_id, None) # Request finished; next one starts fresh
+         self._evict_refs(request_id)
     def update_trolley_status(self, request_id, status_message):
+        if self._last_status_by_req.get(request_id) == status_message: return # Unchanged, skip the write
+        self._last_status_by_req[request_id] = status_message
+        log.info("[Status:%s] %s", request_id, status_message)
+        with self._status_lock:
+            queued = request_id in self._pending_status
+            self._pending_status[request_id] = status_message # Overwrites a stale value not yet written
+        if status_message.startswith(URGENT_STATUS_PREFIXES): self._status_urgent.set()
+        if not queued: self._status_queue.put(request_id)
+    def _queue_write(self, path, value):
+        """Sets path (relative to the root) to value from the status writer, without waiting for it."""
+        with self._status_lock:
+            queued = bool(self._pending_writes) # A token for the pending writes is already on the queue
+            self._pending_writes[path] = value
+        if not queued: self._status_queue.put(path)
+    def _status_writer_loop(self):
+        while True:
+            request_id = self._status_queue.get()
+            try:
+                if request_id is None: return
+                with self._status_lock: stale = not (self._pending_status or self._pending_writes)
+                if stale: continue # Already written as part of an earlier batch; don't hold up flush_status()
+                # Give rapid-fire updates a moment to replace each other before writing
+                if self._status_urgent.wait(self.status_coalesce_window): self._status_urgent.clear()
+                with self._status_lock:
+                    batch, self._pending_status = self._pending_status, {}
+                    updates, self._pending_writes = self._pending_writes, {}
+                if not batch and not updates: continue # Already written as part of an earlier batch
+                updates.update((f"trolleyStatus/{rid}", status) for rid, status in batch.items())
+                try: self._ref().update(updates) # One multi-path write
+                except Exception as e:
+                    log.error("Firebase Error: Could not write %s: %s", ", ".join(updates), e)
+                    for rid, status in batch.items():
+                        if self._last_status_by_req.get(rid) == status: del self._last_status_by_req[rid] # Allow a retry
+            finally: self._status_queue.task_done()
+    def flush_status(self):
+        """Blocks until every queued status update has been written."""
+        self._status_urgent.set() # No point holding back what we're about to wait for
+        self._status_queue.join()
+    def close(self):
+        self._catalog_closed = True # Stops the catalog-sync thread from starting listeners after this
+        for listener in list(self._catalog_listeners):
+            try: listener.close()
+            except Exception as e: log.error("Firebase Error: Could not close catalog listener: %s", e)
+        self._catalog_listeners.clear()
+        if not self._status_writer.is_alive(): return
+        self.flush_status()
+        self._status_queue.put(None)
+        self._status_writer.join(timeout=5)
+    def merge_cart(self, request_id, new_items):
+        """Adds new_items to the stored cart in one server-side transaction; returns the merged cart (qty > 0 only)."""
+        def merge(current_cart):
+            cart = dict(current_cart or {})
+            for product_id, quantity in new_items.items():
+                if product_id in ('processed', 'action'): continue
+                try: cart[product_id] = cart.get(product_id, 0) + int(quantity)
+                except (ValueError, TypeError): continue
+            return {pid: qty for pid, qty in cart.items() if qty > 0}
+        try: return self._ref('trolleyCarts', request_id).transaction(merge) or {}
+        except Exception as e: log.error("Firebase Error: Could not update cart for %s: %s", request_id, e); return merge(None)
+    def prefetch_catalog(self):
+        """Fills the name/UID caches from one read each of /inventory and /products; per-item reads cover anything missed."""
+        try:
+            self._name_cache.update(self._fetch_names())
+            self._uid_cache.update(self._fetch_uids())
+            log.info("Catalog prefetched: %s names, %s UIDs.", len(self._name_cache), len(self._uid_cache))
+        except Exception as e: log.error("Firebase Error: Could not prefetch catalog: %s", e); return
+        self._save_catalog_snapshot()
+    def _sync_catalog(self):
+        """Reads the catalog, then keeps the caches in step with admin edits (listeners start after the read)."""
+        self.prefetch_catalog()
+        self._watch_catalog('products', self._uid_cache, 'uid', str.lower)
+        self._watch_catalog('inventory', self._name_cache, 'name', str)
+    def _load_catalog_snapshot(self):
+        """Fills the caches from the last saved catalog; returns False if there isn't a usable one."""
         try:
-            ref = self.db.reference(f'/trolleyStatus/{request_id}')
-            ref.set(status_message)
-            print(f"[Status:{request_id}] {status_message}")
-        except Exception as e: print(f"Firebase Error: Could not update status for {request_id}: {e}")
-    def get_cart(self, request_id):
-        try: return self.db.reference(f'/trolleyCarts/{request_id}').get() or {}
-        except Exception as e: print(f"Firebase Error: Could not get cart for {request_id}: {e}"); return {}
-    def set_cart(self, request_id, cart_data):
-        try: self.db.reference(f'/trolleyCarts/{request_id}').set(cart_data)
-        except Exception as e: print(f"Firebase Error: Could not set cart for {request_id}: {e}")
+            with open(CATALOG_CACHE_PATH) as f: snapshot = json.load(f)
+            self._name_cache.update(snapshot['names']); self._uid_cache.update(snapshot['uids'])
+        except (OSError, ValueError, KeyError, TypeError) as e: log.info("No catalog snapshot loaded (%s).", e); return False
+        log.info("Catalog snapshot loaded: %s names, %s UIDs.", len(self._name_cache), len(self._uid_cache)); return True
+    def _save_catalog_snapshot(self):
+        snapshot = {'names': dict(self._name_cache), 'uids': dict(self._uid_cache)} # Copies: listeners may be updating
+        with self._snapshot_lock: # Startup prefetch and a SIGHUP refresh may both be saving
+            try:
+                with open(CATALOG_CACHE_PATH + '.tmp', 'w') as f: json.dump(snapshot, f)
+                os.replace(CATALOG_CACHE_PATH + '.tmp', CATALOG_CACHE_PATH) # Never leave a half-written snapshot behind
+            except OSError as e: log.warning("Could not save catalog snapshot: %s", e)
+    def prefetch_for_request(self, product_ids, node_names):
+        """Re-reads /inventory or /products once if a request needs anything the caches lack, instead of item by item."""
+        try:
+            self._prefetch_missing(product_ids, self._name_cache, self._missing_names, self._fetch_names)
+            self._prefetch_missing(node_names, self._uid_cache, self._missing_uids, self._fetch_uids)
+        except Exception as e: log.error("Firebase Error: Could not prefetch request catalog: %s", e)
+    def _prefetch_missing(self, keys, cache, known_missing, fetch):
+        missing = {key for key in keys if key not in cache} - known_missing
+        if not missing: return
+        cache.update(fetch())
+        known_missing.update(key for key in missing if key not in cache) # Not on the server either; don't re-read for it
+    def _fetch_names(self):
+        """Returns {product_id: name} from one read of /inventory."""
+        inventory = self._ref('inventory').get() or {}
+        return {pid: item['name'] for pid, item in inventory.items() if isinstance(item, dict) and item.get('name')}
+    def _fetch_uids(self):
+        """Returns {node_name: lowercased UID} from one read of /products."""
+        products = self._ref('products').get() or {}
+        return {name: node['uid'].lower() for name, node in products.items() if isinstance(node, dict) and node.get('uid')}
+    def refresh_catalog(self):
+        """Replaces the cached names/UIDs with a fresh read, for catalog edits the listeners can't see."""
+        log.info("Refreshing catalog caches...")
+        try: names, uids = self._fetch_names(), self._fetch_uids()
+        except Exception as e: log.error("Firebase Error: Could not refresh catalog, keeping the cached one: %s", e); return
+        # Swapped in only once both reads succeeded, so a failed refresh never empties the caches
+        self._name_cache.clear(); self._name_cache.update(names)
+        self._uid_cache.clear(); self._uid_cache.update(uids)
+        self._missing_names.clear(); self._missing_uids.clear() # The catalog may have been fixed; look again
+        log.info("Catalog refreshed: %s names, %s UIDs.", len(names), len(uids))
+        self._save_catalog_snapshot()
+    def _watch_catalog(self, root, cache, field, normalize):
+        """Listens on /<root> and mirrors each item's <field> into cache."""
+        def store(key, value):
+            if value: cache[key] = normalize(value)
+            else: cache.pop(key, None)
+        def put(parts, data):
+            if not parts: # Whole catalog: initial snapshot or replacement
+                cache.clear()
+                for key, item in (data if isinstance(data, dict) else {}).items(): store(key, item.get(field) if isinstance(item, dict) else None)
+            elif len(parts) == 1: store(parts[0], data.get(field) if isinstance(data, dict) else None) # One item replaced
+            elif len(parts) == 2 and parts[1] == field: store(parts[0], data)
+        def on_change(event):
+            parts = [p for p in event.path.split('/') if p]
+            if event.event_type == 'patch': # Each key is a child path, possibly multi-segment ('pdt2/uid'), set to its value
+                for key, value in (event.data if isinstance(event.data, dict) else {}).items():
+                    put(parts + [p for p in key.split('/') if p], value)
+            else: put(parts, event.data)
+        if self._catalog_closed: return
+        try: listener = self._ref(root).listen(on_change)
+        except Exception as e: log.error("Firebase Error: Could not listen on /%s: %s", root, e); return
+        self._catalog_listeners.append(listener)
+        if self._catalog_closed: listener.close() # close() ran while we were connecting
     def get_product_name(self, product_id):
+        name = self._name_cache.get(product_id)
+        if name is not None: return name
         try:
-            ref = self.db.reference(f'/inventory/{str(product_id)}/name')
-            name = ref.get(); return name if name else "Unknown Product"
-        except Exception as e: print(f"Firebase Error: Could not get name for {product_id}: {e}"); return "Unknown Product"
+            ref = self._ref('inventory', product_id, 'name')
+            name = ref.get()
+            if not name: return "Unknown Product"
+            self._name_cache[product_id] = name; return name
+        except Exception as e: log.error("Firebase Error: Could not get name for %s: %s", product_id, e); return "Unknown Product"
     def get_expected_uid(self, node_name):
+        uid = self._uid_cache.get(node_name)
+        if uid is not None: return uid
+        try:
+            ref = self._ref('products', node_name, 'uid')
+            uid = ref.get()
+            if not uid: return None
+            uid = self._uid_cache[node_name] = uid.lower(); return uid
+        except Exception as e: log.error("Firebase Error: Could not get UID for %s: %s", node_name, e); return None
+    def register_confirmation_listener(self, request_id):
+        """Streams trolleyConfirmations/<request_id> so waits are woken by a push instead of polling."""
+        events = self._confirm_events[request_id] = {'confirmed': threading.Event(), 'homeConfirmed': threading.Event()}
+        def on_change(event):
+            if event.path == '/': changes = event.data if isinstance(event.data, dict) else {}
+            else: changes = {event.path.strip('/').split('/')[0]: event.data}
+            if event.path == '/' and event.event_type == 'put':
+                for flag in events: changes.setdefault(flag, None) # Whole node replaced; absent flags are cleared
+            for flag, value in changes.items():
+                if flag in events: events[flag].set() if value is True else events[flag].clear()
+        try: self._confirm_listeners[request_id] = self._ref('trolleyConfirmations', request_id).listen(on_change)
+        except Exception as e:
+            log.error("Firebase Error: Could not listen for confirmations on %s: %s", request_id, e)
+            del self._confirm_events[request_id] # Waits fall back to polling
+    def unregister_confirmation_listener(self, request_id):
+        self._confirm_events.pop(request_id, None)
+        listener = self._confirm_listeners.pop(request_id, None)
+        if listener is None: return
+        try: listener.close()
+        except Exception as e: log.error("Firebase Error: Could not close confirmation listener for %s: %s", request_id, e)
+    def _wait_for_confirmation_flag(self, request_id, flag, timeout):
+        evt = self._confirm_events.get(request_id, {}).get(flag)
+        if evt is None: return self._wait_for_flag(('trolleyConfirmations', request_id, flag), timeout=timeout)
+        if not evt.wait(timeout):
+            log.warning("Timeout waiting for flag at /trolleyConfirmations/%s/%s", request_id, flag); return False
+        evt.clear()
+        self._queue_write(f"trolleyConfirmations/{request_id}/{flag}", False) # Reset in the background; the trolley moves on now
+        return True
+    def _await_flag(self, path_parts, predicate, timeout):
+        """
+        Blocks until the value at path_parts satisfies predicate, woken by a listener push.
+        Returns True on a match, False on timeout, None if the path can't be listened to.
+        """
+        flag_ref = self._ref(*path_parts)
+        path = flag_ref.path
+        matched = threading.Event()
+        def on_change(event):
+            if event.path == '/' and predicate(event.data): matched.set()
+        try: listener = flag_ref.listen(on_change)
+        except Exception as e: log.warning("Could not listen on %s (%s).", path, e); return None
         try:
-            ref = self.db.reference(f'/products/{str(node_name)}/uid')
-            uid = ref.get(); return uid.lower() if uid else None
-        except Exception as e: print(f"Firebase Error: Could not get UID for {node_name}: {e}"); return None
-    def _wait_for_flag(self, path, poll_interval=0.5, timeout=60):
+            if not matched.wait(timeout): log.warning("Timeout waiting for flag at %s", path); return False
+            return True
+        finally:
+            try: listener.close()
+            except Exception as e: log.error("Firebase Error: Could not close listener on %s: %s", path, e)
+    def _wait_for_flag(self, path_parts, poll_interval=0.5, timeout=60):
+        """Waits for the flag at path_parts to become True, then resets it to False (polls only if listening fails)."""
+        flag_ref = self._ref(*path_parts)
+        seen = self._await_flag(path_parts, lambda value: value is True, timeout)
+        if seen is None: return self._poll_for_flag(flag_ref, poll_interval, timeout)
+        if not seen: return False
+        try: flag_ref.set(False)
+        except Exception: log.warning("Could not reset flag at %s", flag_ref.path)
+        return True
+    def _poll_for_flag(self, flag_ref, poll_interval, timeout):
+        path = flag_ref.path
         start_time = time.time()
         try:
-            flag_ref = self.db.reference(path)
             while time.time() - start_time < timeout:
                 if flag_ref.get() is True:
                     try: flag_ref.set(False)
-                    except Exception: print(f"Warning: Could not reset flag at {path}")
+                    except Exception: log.warning("Could not reset flag at %s", path)
                     return True
                 time.sleep(poll_interval)
-            print(f"Timeout waiting for flag at {path}"); return False
-        except Exception as e: print(f"Firebase Error: Waiting for flag at {path}: {e}"); return False
+            log.warning("Timeout waiting for flag at %s", path); return False
+        except Exception as e: log.error("Firebase Error: Waiting for flag at %s: %s", path, e); return False
     def wait_for_confirmation(self, request_id, timeout=60):
-        print(f"Waiting for item confirmation ({request_id})...")
-        path = f'/trolleyConfirmations/{request_id}/confirmed'
-        if self._wait_for_flag(path, timeout=timeout): print(f"Item confirmation received ({request_id})."); return True
-        print(f"Failed to get item confirmation ({request_id})."); return False
+        log.info("Waiting for item confirmation (%s)...", request_id)
+        if self._wait_for_confirmation_flag(request_id, 'confirmed', timeout): log.info("Item confirmation received (%s).", request_id); return True
+        log.warning("Failed to get item confirmation (%s).", request_id); return False
     def wait_for_home_confirmation(self, request_id, timeout=60):
-        print(f"Waiting for home confirmation ({request_id})...")
-        path = f'/trolleyConfirmations/{request_id}/homeConfirmed'
-        if self._wait_for_flag(path, timeout=timeout): print(f"Home confirmation received ({request_id})."); return True
-        print(f"Failed to get home confirmation ({request_id})."); return False
+        log.info("Waiting for home confirmation (%s)...", request_id)
+        if self._wait_for_confirmation_flag(request_id, 'homeConfirmed', timeout): log.info("Home confirmation received (%s).", request_id); return True
+        log.warning("Failed to get home confirmation (%s).", request_id); return False
 
 # --- Navigation Logic (Sensor print added) ---
 class Navigator:
@@ -265,6 +743,7 @@ class Navigator:
     NAV_STATE_TURNING = 2
     NAV_STATE_LOST = 3
     NAV_STATE_ARRIVED = 4
+    NAV_STATE_TIMEOUT = 5
     
     # --- Add NEW method to class Navigator ---
     def reverse_until_node(self, destination_node_name, request_id):
@@ -274,51 +753,50 @@ class Navigator:
 
         # Cannot reverse from home or to home using this method
         if self.current_node == "home" or destination_node_name == "home":
-             print("ERROR: reverse_until_node cannot be used to/from home.")
+             log.error("reverse_until_node cannot be used to/from home.")
              return False
 
-        print(f"Reversing from '{self.current_node}' towards '{destination_node_name}'...")
+        log.info("Reversing from '%s' towards '%s'...", self.current_node, destination_node_name)
         self.fb.update_trolley_status(request_id, f"reversing_to:{destination_node_name}")
 
         expected_uid = self.fb.get_expected_uid(destination_node_name)
-        print(f"DEBUG: Expecting UID for {destination_node_name}: {expected_uid}")
+        log.debug("Expecting UID for %s: %s", destination_node_name, expected_uid)
         if expected_uid is None:
-             print(f"ERROR: Cannot reverse, no UID for destination '{destination_node_name}'")
+             log.error("Cannot reverse, no UID for destination '%s'", destination_node_name)
              self.fb.update_trolley_status(request_id, f"error:no_uid:{destination_node_name}"); return False
 
         # Send Backward Command
         self.hw.send_command(CMD_BACKWARD)
 
-        start_time = time.time()
+        deadline = time.monotonic() + self.navigation_timeout
         # Use navigation_timeout or a specific reverse_timeout? Let's use navigation_timeout for now.
 
-        while time.time() - start_time < self.navigation_timeout:
-            # 1. Check for RFID
-            serial_line = self.hw.receive_line()
+        while (remaining := deadline - time.monotonic()) > 0:
+            # 1. Check for RFID. Nothing else to do while reversing, so just wait on the port
+            serial_line = self.hw.receive_line(wait_ms=int(remaining * 1000) + 1)
             if serial_line and serial_line.startswith("RFID:"):
+                self.hw.note_tag_stop() # ESP32 halts itself on every tag read
                 received_uid = serial_line[5:].lower()
-                print(f"DEBUG: RFID Detected UID (Reversing): {received_uid}")
-                # print(f"DEBUG: RFID Expected UID: {expected_uid}") # Already printed
+                log.debug("RFID Detected UID (Reversing): %s", received_uid)
+                # log.debug("RFID Expected UID: %s", expected_uid) # Already logged
 
                 if received_uid == expected_uid:
-                    print(f"SUCCESS: Reached destination '{destination_node_name}' while reversing (UID Match)")
+                    log.info("SUCCESS: Reached destination '%s' while reversing (UID Match)", destination_node_name)
                     self.hw.send_command(CMD_STOP) # Stop ESP32
                     self.current_node = destination_node_name # Update position
                     self.fb.update_trolley_status(request_id, f"arrived_at:{destination_node_name}")
-                    time.sleep(0.5) # Small pause after stopping
                     return True
                 else:
-                    # ESP32 stops on ANY RFID read. Tell it to reverse again if wrong tag seen.
-                    print(f"Incorrect RFID tag while reversing. Expected {expected_uid}, Got {received_uid}. Continuing reverse...")
+                    # ESP32 stops on ANY RFID read. Tell it to reverse again if wrong tag seen;
+                    # a repeat read of the same tag just lands here again.
+                    log.warning("Incorrect RFID tag while reversing. Expected %s, Got %s. Continuing reverse...", expected_uid, received_uid)
                     self.hw.send_command(CMD_BACKWARD)
-                    time.sleep(0.3) # Avoid immediate re-read
 
             # No line following check in this simple reverse mode
-            time.sleep(0.05) # Check RFID periodically
 
         # --- Loop End (Timeout) ---
-        print(f"ERROR: Reversing timed out after {self.navigation_timeout}s!")
-        self.hw.send_command(CMD_STOP)
+        log.error("Reversing timed out after %ss!", self.navigation_timeout)
+        self.hw.send_command(CMD_STOP, force=True)
         self.fb.update_trolley_status(request_id, f"error:reverse_timeout:{self.current_node}->{destination_node_name}")
         return False
 
@@ -330,25 +808,24 @@ class Navigator:
         self.current_node = "home"
         self.navigation_timeout = 60
         self.turn_timeout = 20
+        self.control_period = 0.05 # Control loop cadence (s)
+        self._executor = ThreadPoolExecutor(max_workers=1) # Background Firebase lookups
+        self._follower = LineFollowerThread(self.hw, self.lf, self.control_period)
+        self._follower.start()
+
+    def close(self):
+        """Releases the background lookup and line follower threads."""
+        self._follower.shutdown()
+        self._executor.shutdown(wait=False)
 
     def get_current_node(self):
         # (Code remains the same as previous version)
         return self.current_node
 
     def _get_turn_for_transition(self, start_node, end_node):
-        # (Code remains the same as previous version with corrections 2 & 3)
-        print(f"DEBUG: Determining turn for {start_node} -> {end_node}")
-        if start_node == "home" and end_node.startswith("RFJ"):
-            print("DEBUG: home->RFJ = FWD"); return None
-        if start_node.startswith("RFJ") and end_node.startswith("pdt"):
-             print("DEBUG: RFJ->pdt = RIGHT"); return CMD_RIGHT
-        if start_node.startswith("RBJ") and end_node.startswith("RFJ"):
-             print("DEBUG: RBJ->RFJ = RIGHT"); return CMD_RIGHT
-        if start_node.startswith("RBJ") and end_node.startswith("RBJ"):
-             print("DEBUG: RBJ->RBJ = LEFT"); return CMD_LEFT
-        if start_node.startswith("RFJ") and end_node == "home":
-             print("DEBUG: RFJ->home = RIGHT"); return CMD_RIGHT
-        print(f"DEBUG: Default transition {start_node}->{end_node} = FWD"); return None
+        turn = TURN_FOR_TRANSITION.get((start_node, end_node))
+        if log.isEnabledFor(logging.DEBUG): log.debug("Turn for %s -> %s = %s", start_node, end_node, (turn or b'FWD').decode())
+        return turn
 
     # Inside the Navigator class:
 
@@ -362,32 +839,26 @@ class Navigator:
         Executes turn (L or R). Stops when ANY sensor detects a line ('0').
         Simplified: No check for leaving initial line first.
         """
-        print(f"Executing simplified turn (Stop on Any Detect): {turn_command}")
+        log.info("Executing simplified turn (Stop on Any Detect): %s", turn_command.decode())
         self.hw.send_command(turn_command)
-        start_time = time.time()
+        start_time = time.monotonic()
         # Brief initial delay to ensure turn physically starts before checking sensors
         time.sleep(1.5) # TUNABLE: Adjust if needed
 
-        while time.time() - start_time < self.turn_timeout:
-            sensors = self.hw.read_ir_sensors()
-            left, center, right = sensors
-            # Assumes 0=Black, 1=White
-            print(f"Turning... Sensors: {left}{center}{right}") # Keep print uncommented
-
-            # Look for ANY sensor to detect the new line (a '0')
-            if left == 1 or center == 1 or right == 0:
-                print(f"DEBUG: New line detected by at least one sensor ({left}{center}{right}). Stopping turn.")
-                time.sleep(0.9)
-                self.hw.send_command(CMD_STOP)
-                time.sleep(0.2) # Pause briefly
-                return True # Indicate turn procedure finished
-
-            time.sleep(0.05) # Small delay in loop
+        # The new line is found when ANY sensor sees it: left or center reads 1, or right reads 0.
+        # Assumes 0=Black, 1=White, so the only 'still searching' word is TURN_SEARCHING_BITS.
+        bits = self.hw.wait_for_ir_change(TURN_SEARCHING_BITS, max(0.0, self.turn_timeout - (time.monotonic() - start_time)))
+        if bits is not None:
+            log.debug("New line detected by at least one sensor (%s%s%s). Stopping turn.", bits & 1, (bits >> 1) & 1, (bits >> 2) & 1)
+            time.sleep(0.9)
+            self.hw.send_command(CMD_STOP)
+            time.sleep(0.2) # Pause briefly
+            return True # Indicate turn procedure finished
 
         # Timeout handling
-        print(f"ERROR: Turn timed out after {self.turn_timeout}s! Sensors: {left}{center}{right}")
-        self.hw.send_command(CMD_STOP)
-        self.fb.update_trolley_status(request_id, f"error:turn_timeout:{turn_command}")
+        log.error("Turn timed out after %ss! Sensors: %s%s%s", self.turn_timeout, *self.hw.read_ir_sensors())
+        self.hw.send_command(CMD_STOP, force=True)
+        self.fb.update_trolley_status(request_id, f"error:turn_timeout:{turn_command.decode()}")
         return False
 
         
@@ -395,157 +866,155 @@ class Navigator:
         """Navigates from the current_node to the destination_node_name."""
         # (Code includes RFID debug prints from previous answer)
         if self.current_node == destination_node_name:
-            print(f"Already at destination: {destination_node_name}")
+            log.info("Already at destination: %s", destination_node_name)
             return True
 
-        print(f"Navigating from '{self.current_node}' to '{destination_node_name}'")
+        log.info("Navigating from '%s' to '%s'", self.current_node, destination_node_name)
         self.fb.update_trolley_status(request_id, f"moving_to:{destination_node_name}")
 
-        expected_uid = self.fb.get_expected_uid(destination_node_name)
-        print(f"DEBUG: Expecting UID for {destination_node_name}: {expected_uid}")
-        if expected_uid is None:
-             print(f"ERROR: Cannot navigate, no UID found for destination '{destination_node_name}'")
-             self.fb.update_trolley_status(request_id, f"error:no_uid:{destination_node_name}")
-             return False
+        # Fetch the UID in the background so the Firebase round trip overlaps the initial turn
+        uid_future = self._executor.submit(self.fb.get_expected_uid, destination_node_name)
+
+        # Already sitting on the destination tag (e.g. after a restart)? Check before moving at all
+        serial_line = self.hw.receive_line(wait_ms=100)
+        if serial_line and serial_line.startswith("RFID:"):
+            self.hw.note_tag_stop() # ESP32 halts itself on every tag read
+            scanned_uid = serial_line[5:].lower()
+            if scanned_uid and scanned_uid == uid_future.result():
+                log.info("Already on destination tag '%s' (UID Match)", destination_node_name)
+                self.current_node = destination_node_name
+                self.fb.update_trolley_status(request_id, f"arrived_at:{destination_node_name}")
+                return True
 
         initial_turn = self._get_turn_for_transition(self.current_node, destination_node_name)
-        if initial_turn:
-            if not self.execute_simple_turn(initial_turn, request_id):
-                return False
-            self.hw.send_command(CMD_FORWARD) # Start forward after successful turn
-        else:
-            self.hw.send_command(CMD_FORWARD) # Start forward if no initial turn
+        if initial_turn and not self.execute_simple_turn(initial_turn, request_id):
+            return False
 
-        start_time = time.time()
-        last_line_state = None
-        last_command_sent = CMD_FORWARD
+        expected_uid = uid_future.result()
+        log.debug("Expecting UID for %s: %s", destination_node_name, expected_uid)
+        if expected_uid is None:
+             log.error("Cannot navigate, no UID found for destination '%s'", destination_node_name)
+             self.fb.update_trolley_status(request_id, f"error:no_uid:{destination_node_name}")
+             return False
+        self.hw.send_command(CMD_FORWARD) # Start forward (after the turn, if any)
 
-        while time.time() - start_time < self.navigation_timeout:
-            # 1. Check for RFID first (as it causes ESP32 to stop)
-            serial_line = self.hw.receive_line()
-            if serial_line and serial_line.startswith("RFID:"):
-                received_uid = serial_line[5:].lower()
-                print(f"DEBUG: RFID Detected UID: {received_uid}")
-                print(f"DEBUG: RFID Expected UID: {expected_uid}")
-                if received_uid == expected_uid:
-                    print(f"SUCCESS: Reached destination '{destination_node_name}' (UID Match)")
-                    # ESP32 already stopped, ensure Pi knows to stop sending commands
-                    last_command_sent = CMD_STOP # Update internal state
-                    self.current_node = destination_node_name
-                    self.fb.update_trolley_status(request_id, f"arrived_at:{destination_node_name}")
-                    time.sleep(0.5) # Pause after arrival confirmation
-                    return True
-                else:
-                    print(f"Incorrect RFID tag. Expected {expected_uid}, Got {received_uid}. Continuing...")
-                    # Tell ESP32 (which stopped) to move again
-                    self.hw.send_command(CMD_FORWARD)
-                    last_command_sent = CMD_FORWARD
-                    time.sleep(0.3) # Avoid immediate re-read
-                    continue # Skip line following for this iteration
-
-            # 2. Read Sensors and Determine Required Command
-            sensors = self.hw.read_ir_sensors()
-            # --- ADDED SENSOR PRINT ---
-            #print(f"DEBUG: Sensors LCR = {sensors}") # Print raw sensor values
-            # ---
-            line_state = self.lf.get_state(*sensors)
-            required_command = last_command_sent # Default to previous command
-
-            if line_state == LINE_CENTERED:
-                required_command = CMD_FORWARD
-            elif line_state == LINE_SLIGHT_LEFT: # Robot is LEFT -> needs RIGHT correction
-                required_command = CMD_SLIGHT_RIGHT # Command 'N'
-            elif line_state == LINE_SLIGHT_RIGHT: # Robot is RIGHT -> needs LEFT correction
-                required_command = CMD_SLIGHT_LEFT # Command 'M'
-            # Note: LINE_LOST handling is currently disabled in LineFollower
-
-            # 3. Send Command (Only if changed)
-            if required_command != last_command_sent:
-                #print(f"DEBUG: State={line_state}, Sending Command={required_command}") # Added State Info
-                self.hw.send_command(required_command)
-                last_command_sent = required_command
-
-            # Small delay in loop
-            time.sleep(0.05) # Adjust as needed
+        if self._drive_to_tag(expected_uid) == self.NAV_STATE_ARRIVED:
+            log.info("SUCCESS: Reached destination '%s' (UID Match)", destination_node_name)
+            self.current_node = destination_node_name
+            self.fb.update_trolley_status(request_id, f"arrived_at:{destination_node_name}")
+            return True
 
         # --- Loop End (Timeout) ---
-        print(f"ERROR: Navigation timed out after {self.navigation_timeout}s!")
-        self.hw.send_command(CMD_STOP)
+        log.error("Navigation timed out after %ss!", self.navigation_timeout)
+        self.hw.send_command(CMD_STOP, force=True)
         self.fb.update_trolley_status(request_id, f"error:nav_timeout:{self.current_node}->{destination_node_name}")
         return False
 
+    def _drive_to_tag(self, expected_uid):
+        """
+        Follows the line until the tag with expected_uid is read. Steering runs on
+        the LineFollowerThread; this thread only waits on the serial port, so a tag
+        is seen as soon as it arrives. Kept free of Firebase/status work.
+        Returns: NAV_STATE_ARRIVED on UID match, NAV_STATE_TIMEOUT otherwise.
+        """
+        receive_line = self.hw.receive_line
+        follower = self._follower
+        deadline = time.monotonic() + self.navigation_timeout
+        follower.arm()
+        try:
+            while (remaining := deadline - time.monotonic()) > 0:
+                serial_line = receive_line(wait_ms=int(remaining * 1000) + 1)
+                if not (serial_line and serial_line.startswith("RFID:")):
+                    continue
+                # ESP32 stopped on the tag; hold steering until we know which tag it is
+                follower.disarm()
+                self.hw.note_tag_stop()
+                received_uid = serial_line[5:].lower()
+                log.debug("RFID Detected UID: %s", received_uid)
+                log.debug("RFID Expected UID: %s", expected_uid)
+                if received_uid == expected_uid:
+                    self.hw.send_command(CMD_STOP, force=True) # In case a correction slipped out before disarm
+                    return self.NAV_STATE_ARRIVED
+                log.warning("Incorrect RFID tag. Expected %s, Got %s. Continuing...", expected_uid, received_uid)
+                # The follower resumes with whichever command the current sensor state calls for
+                follower.arm()
+            return self.NAV_STATE_TIMEOUT
+        finally:
+            follower.disarm()
+
 
     def set_current_position(self, node_name):
         """Manually set the current node position"""
         # (Code remains the same as previous version)
         if node_name in NODE_MAPPING or node_name == "home":
-            print(f"Manually setting current node to: {node_name}")
+            log.info("Manually setting current node to: %s", node_name)
             self.current_node = node_name
         else:
-            print(f"Warning: Attempted to set invalid node position: {node_name}")
+            log.warning("Attempted to set invalid node position: %s", node_name)
 
 
 # --- Main Controller ---
 class TrolleyController:
 	# --- MODIFY method in class TrolleyController ---
     def _move_trolley_to_home(self, request_id):
-        """Navigates the trolley back to the home position, using REVERSE from RBJ."""
-        print("[Trolley] Request received to move to home position...")
+        """Navigates the trolley back to the home position, using REVERSE from RBJ. Returns True once at home."""
+        log.info("[Trolley] Request received to move to home position...")
         self.firebase_comm.update_trolley_status(request_id, "moving_to:home")
         current_node = self.navigator.get_current_node()
-        print(f"Current Node: {current_node}")
+        log.info("Current Node: %s", current_node)
 
         if current_node == "home":
-             print("Already at home."); self.firebase_comm.update_trolley_status(request_id, "arrived_at:home"); return
+             log.info("Already at home."); self.firebase_comm.update_trolley_status(request_id, "arrived_at:home"); return True
 
         path_ok = True
         target_rfj = None # Keep track of the RFJ we are aiming for from aisle
 
         # Step 1: If in aisle (pdt or RBJ), move towards the corresponding RFJ
-        if current_node.startswith("pdt") or current_node.startswith("RBJ"):
+        node_info = NODE_INFO[current_node]
+        if node_info.kind in (NODE_KIND_PDT, NODE_KIND_RBJ):
             try:
-                row_num_str = current_node[-1]
-                target_rfj = f"RFJ{row_num_str}"
-                print(f"Path: {current_node} -> {target_rfj} -> home")
+                target_rfj = f"RFJ{node_info.row}"
+                log.info("Path: %s -> %s -> home", current_node, target_rfj)
 
                 # --- MODIFIED SECTION: RBJ to RFJ ---
                 # Step 1a: If at RBJ, REVERSE to RFJ (no turn needed first)
-                if current_node.startswith("RBJ"):
-                    print(f"Reversing from {current_node} towards {target_rfj}...")
+                if node_info.kind == NODE_KIND_RBJ:
+                    log.info("Reversing from %s towards %s...", current_node, target_rfj)
                     if not self.navigator.reverse_until_node(target_rfj, request_id):
                          path_ok = False # Failed reversing step
 
                 # Step 1b: If started at pdt, navigate FORWARD to RFJ (using standard navigate)
-                elif current_node.startswith("pdt"):
-                    print(f"Navigating forward from {current_node} towards {target_rfj}...")
+                else:
+                    log.info("Navigating forward from %s towards %s...", current_node, target_rfj)
                     if not self.navigator.navigate_to_node(target_rfj, request_id):
                          path_ok = False
                 # --- END MODIFIED SECTION ---
 
             except Exception as e:
-                 print(f"Error determining path from aisle node {current_node}: {e}")
+                 log.error("Error determining path from aisle node %s: %s", current_node, e)
                  path_ok = False
 
         # Step 2: Check if we are now at an RFJ
         current_node = self.navigator.get_current_node() # Update position
-        if path_ok and current_node.startswith("RFJ"):
+        if path_ok and NODE_INFO[current_node].kind == NODE_KIND_RFJ:
              # Turn towards home direction
-             print(f"Currently at {current_node}. Turning right towards home area...")
+             log.info("Currently at %s. Turning right towards home area...", current_node)
              if not self.navigator.execute_simple_turn(CMD_RIGHT, request_id):
                   path_ok = False
 
         # Step 3: Final navigation to home
         if path_ok:
             if self.navigator.get_current_node() != "home":
-                 print("Proceeding to 'home' node...")
+                 log.info("Proceeding to 'home' node...")
                  if not self.navigator.navigate_to_node("home", request_id):
                       path_ok = False
 
         # Final Status Update
         if path_ok and self.navigator.get_current_node() == "home":
-             self.firebase_comm.update_trolley_status(request_id, "arrived_at:home"); print("[Trolley] Arrived at home position.")
-        else:
-             print("[Trolley] Failed to return home.")
+             self.firebase_comm.update_trolley_status(request_id, "arrived_at:home"); log.info("[Trolley] Arrived at home position.")
+             return True
+        log.warning("[Trolley] Failed to return home.")
+        return False
     """Orchestrates the shopping process using Firebase, Navigator, etc."""
     # ... (__init__, _handle_new_request_callback, process_request, _move_trolley_to_home methods remain the same) ...
     # ... (process_shopping_list method remains the same) ...
@@ -559,6 +1028,13 @@ class TrolleyController:
         self.line_follower = None
         self.navigator = None
         self._running = False
+        self._stop_event = threading.Event()
+        self._busy = False # True while run() is processing a request
+        self._inflight = set() # Request ids queued or being processed (single controller, so no need for a shared flag in Firebase)
+        self._request_queue = queue.SimpleQueue() # (request_id, data) from the listener; None wakes run() to exit. put() is reentrant, so signal handlers may use it
+        self._inflight_lock = threading.Lock()
+        # request 'action' -> handler(request_id, data); requests without a known action are shopping lists
+        self._actions = {'home': self._process_home_request}
         try:
             self.firebase_comm = FirebaseComm(FIREBASE_CRED_PATH, FIREBASE_DB_URL)
             self.hw_interface = HardwareInterface(SERIAL_PORT, SERIAL_BAUD, IR_PIN_LEFT, IR_PIN_CENTER, IR_PIN_RIGHT)
@@ -566,7 +1042,7 @@ class TrolleyController:
             self.navigator = Navigator(self.hw_interface, self.line_follower, self.firebase_comm)
             self.navigator.set_current_position("home")
         except Exception as e:
-             print(f"FATAL: Error during TrolleyController initialization: {e}")
+             log.critical("Error during TrolleyController initialization: %s", e)
              self.cleanup()
              sys.exit(1)
 
@@ -574,172 +1050,206 @@ class TrolleyController:
         if event.event_type in ['put', 'patch']:
             request_id = event.path.split('/')[-1]
             if not request_id or request_id == 'trolleyRequests' or event.data is None: return
-            print(f"\n--- New Event Received ---")
-            print(f"Data: {event.data}")
-            print(f"Request ID derived: {request_id}")
-            if self.firebase_comm.is_processing(request_id):
-                print(f"Request {request_id} is already being processed. Ignoring.")
-                return
-            self.firebase_comm.set_processing_status(request_id, True)
-            print(f"Processing request {request_id}...")
-            try:
-                self.process_request(request_id, event.data)
-                print(f"Finished processing {request_id}.")
-            except Exception as e:
-                 print(f"!!! CRITICAL ERROR during processing {request_id}: {e}")
-                 try:
-                      self.firebase_comm.update_trolley_status(request_id, f"error:critical_processing_exception")
-                      self.hw_interface.send_command(CMD_STOP)
-                 except: pass
-            finally:
-                 print(f"Deleting processing flag for {request_id}.")
-                 self.firebase_comm.delete_processing_status(request_id)
-                 print(f"--- Event Handling Complete ({request_id}) ---\n")
+            request_id = sys.intern(request_id) # Keys every per-request dict for the rest of the request
+            log.info("--- New Event Received ---")
+            log.info("Data: %s", event.data)
+            log.info("Request ID derived: %s", request_id)
+            with self._inflight_lock:
+                if request_id in self._inflight:
+                    log.info("Request %s is already queued or being processed. Ignoring.", request_id)
+                    return
+                self._inflight.add(request_id)
+            # Hand off to the main thread so this listener keeps delivering events during a long trip
+            self._request_queue.put((request_id, event.data))
+
+    def _process_queued_request(self, request_id, data):
+        """Runs one queued request on the main thread, then releases it."""
+        self.firebase_comm.register_confirmation_listener(request_id)
+        log.info("Processing request %s...", request_id)
+        try:
+            self.process_request(request_id, data)
+            log.info("Finished processing %s.", request_id)
+        except Exception as e:
+             log.error("!!! CRITICAL ERROR during processing %s: %s", request_id, e)
+             try:
+                  self.firebase_comm.update_trolley_status(request_id, f"error:critical_processing_exception")
+                  self.hw_interface.send_command(CMD_STOP, force=True)
+             except: pass
+        finally:
+             self.firebase_comm.unregister_confirmation_listener(request_id)
+             self.firebase_comm.release_request(request_id)
+             with self._inflight_lock: self._inflight.discard(request_id)
+             log.info("--- Event Handling Complete (%s) ---", request_id)
 
     def process_request(self, request_id, data):
-        action = data.get('action')
-        if action == 'home':
-            self._move_trolley_to_home(request_id)
-            if success:
-                self.firebase_comm.update_trolley_status(request_id, "completed")
-
-        elif 'cart' in data and isinstance(data['cart'], dict):
+        handler = self._actions.get(data.get('action'))
+        if handler:
+            handler(request_id, data)
+        elif isinstance(data.get('cart'), dict):
             self.process_shopping_list(request_id, data)
         else:
-            print(f"Error: Invalid request format for {request_id}.")
+            log.error("Invalid request format for %s.", request_id)
             self.firebase_comm.update_trolley_status(request_id, "error:invalid_request_format")
 
+    def _process_home_request(self, request_id, data):
+        if self._move_trolley_to_home(request_id):
+            self.firebase_comm.update_trolley_status(request_id, "completed")
 
     def process_shopping_list(self, request_id, request_data):
         self.firebase_comm.update_trolley_status(request_id, "processing_list")
-        print(f"[Trolley:{request_id}] Processing shopping list...")
-        new_cart_items = request_data.get('cart', {})
-        existing_cart = self.firebase_comm.get_cart(request_id)
-        for product_id, quantity in new_cart_items.items():
-            if product_id in ('processed', 'action'): continue
-            try:
-                current_qty = existing_cart.get(product_id, 0)
-                add_qty = int(quantity)
-                existing_cart[product_id] = current_qty + add_qty
-            except (ValueError, TypeError): continue
-        final_cart = {pid: qty for pid, qty in existing_cart.items() if qty > 0}
-        print(f"Final Cart (qty > 0): {final_cart}")
-        self.firebase_comm.set_cart(request_id, final_cart)
-        products_by_row = {1: [], 2: [], 3: []}
-        valid_products_in_cart = []
-        highest_row_with_items = 0
-        for product_id in sorted(final_cart.keys()):
-             row = PRODUCT_ROWS.get(product_id)
-             if row in products_by_row:
-                 products_by_row[row].append(product_id)
-                 valid_products_in_cart.append(product_id)
-                 highest_row_with_items = max(highest_row_with_items, row)
-             else: print(f"Warning: Product {product_id} has no assigned row. Skipping.")
-        print(f"Products for Row 1: {products_by_row[1]}")
-        print(f"Products for Row 2: {products_by_row[2]}")
-        print(f"Products for Row 3: {products_by_row[3]}")
-        if not valid_products_in_cart:
-             print("No valid products in cart to process.")
+        log.info("[Trolley:%s] Processing shopping list...", request_id)
+        final_cart = self.firebase_comm.merge_cart(request_id, request_data.get('cart', {}))
+        log.info("Final Cart (qty > 0): %s", final_cart)
+        for product_id in final_cart:
+             if product_id not in PRODUCT_ROWS: log.warning("Product %s has no assigned row. Skipping.", product_id)
+        # One pass over the (ordered) layout gives each row's products in visit order, rows in order; no sorting
+        products_by_row = {}
+        for row_num, row_order in PRODUCT_ORDER_IN_ROW.items():
+            in_row = [pid for pid in row_order if pid in final_cart]
+            if in_row: products_by_row[row_num] = in_row
+        for row_num in PRODUCT_ORDER_IN_ROW: log.info("Products for Row %s: %s", row_num, products_by_row.get(row_num, []))
+        # Everything this trip will look up: the products, their rows' junctions and home
+        trip_products = [pid for row_products in products_by_row.values() for pid in row_products]
+        trip_nodes = trip_products + [f"R{side}J{row}" for row in products_by_row for side in "FB"] + ["home"]
+        self.firebase_comm.prefetch_for_request(trip_products, trip_nodes)
+        if not products_by_row:
+             log.info("No valid products in cart to process.")
              self.firebase_comm.update_trolley_status(request_id, "completed_empty_cart")
              self._move_trolley_to_home(request_id)
              return
+        highest_row_with_items = max(products_by_row)
         navigation_ok = True
-        processed_rows = []
-        for row_num in sorted(products_by_row.keys()):
-            if products_by_row[row_num]:
-                processed_rows.append(row_num)
-                print(f"\n--- Processing Row {row_num} ---")
-                is_last_row_to_process = (row_num == highest_row_with_items)
-                navigation_ok = self._process_row(request_id, products_by_row[row_num], row_num, is_last_row_to_process)
-                if not navigation_ok: break
+        for row_num in products_by_row: # Already in row order
+            log.info("--- Processing Row %s ---", row_num)
+            is_last_row_to_process = (row_num == highest_row_with_items)
+            navigation_ok = self._process_row(request_id, products_by_row[row_num], row_num, is_last_row_to_process)
+            if not navigation_ok: break
         if navigation_ok:
-            print("\n--- Returning to Home ---")
+            log.info("--- Returning to Home ---")
             self.firebase_comm.update_trolley_status(request_id, "waiting_for_home_confirmation")
             if not self.firebase_comm.wait_for_home_confirmation(request_id):
-                 print("Home confirmation failed or timed out. Stopping.")
+                 log.warning("Home confirmation failed or timed out. Stopping.")
                  self.firebase_comm.update_trolley_status(request_id, "error:home_confirmation_failed")
-                 self.hw_interface.send_command(CMD_STOP)
+                 self.hw_interface.send_command(CMD_STOP, force=True)
                  return
             self.firebase_comm.update_trolley_status(request_id, "returning_home")
-            print("User confirmed. Returning home.")
+            log.info("User confirmed. Returning home.")
             self._move_trolley_to_home(request_id)
-        else: print("[Trolley] Processing stopped due to error.")
+        else: log.warning("[Trolley] Processing stopped due to error.")
 
     def _process_row(self, request_id, product_list, row_number, is_last_row):
         self.firebase_comm.update_trolley_status(request_id, f"processing_row:{row_number}")
         row_front_junction = f"RFJ{row_number}"
         row_back_junction = f"RBJ{row_number}"
-        print(f"Moving to start of row {row_number}: {row_front_junction}")
+        log.info("Moving to start of row %s: %s", row_number, row_front_junction)
         if not self.navigator.navigate_to_node(row_front_junction, request_id): return False
-        #print(f"DEBUG: Nudging forward slightly at {row_front_junction}...")
+        #log.debug("Nudging forward slightly at %s...", row_front_junction)
         self.hw_interface.send_command(CMD_FORWARD)
         time.sleep(0.5)
         self.hw_interface.send_command(CMD_STOP)
         time.sleep(0.1)
-        print(f"Turning right into row {row_number} aisle...")
+        log.info("Turning right into row %s aisle...", row_number)
         if not self.navigator.execute_simple_turn(CMD_RIGHT, request_id): return False
-        sorted_product_list = sorted(product_list, key=lambda pid: NODE_MAPPING.get(pid, float('inf')))
-        for product_id in sorted_product_list:
+        for product_id in product_list: # Already in aisle order
             product_node_name = product_id
             product_name = self.firebase_comm.get_product_name(product_id)
-            print(f"  Seeking product: {product_name} ({product_node_name})")
+            log.info("Seeking product: %s (%s)", product_name, product_node_name)
             self.firebase_comm.update_trolley_status(request_id, f"moving_to_product:{product_node_name}")
             if not self.navigator.navigate_to_node(product_node_name, request_id): return False
-            print(f"  Arrived at {product_name}. Prompting user...")
+            log.info("Arrived at %s. Prompting user...", product_name)
             self.firebase_comm.update_trolley_status(request_id, f"waiting_for_item:{product_id}:{product_name}")
             if not self.firebase_comm.wait_for_confirmation(request_id):
-                 print("Item confirmation failed or timed out.")
+                 log.warning("Item confirmation failed or timed out.")
                  self.firebase_comm.update_trolley_status(request_id, f"error:item_confirmation_failed:{product_id}")
-                 self.hw_interface.send_command(CMD_STOP)
+                 self.hw_interface.send_command(CMD_STOP, force=True)
                  return False
-            print(f"  User added {product_name}. Proceeding...")
+            log.info("User added %s. Proceeding...", product_name)
             self.firebase_comm.update_trolley_status(request_id, f"item_added:{product_id}")
-        print(f"Finished products in row {row_number}. Moving to end: {row_back_junction}")
+        log.info("Finished products in row %s. Moving to end: %s", row_number, row_back_junction)
         if not self.navigator.navigate_to_node(row_back_junction, request_id): return False
         if not is_last_row:
-            print(f"More rows to process. Turning left at {row_back_junction}...")
+            log.info("More rows to process. Turning left at %s...", row_back_junction)
             if not self.navigator.execute_simple_turn(CMD_LEFT, request_id): return False
-        else: print(f"This was the last row ({row_number}). No turn needed at {row_back_junction}.")
-        print(f"--- Row {row_number} Processing Complete ---")
+        else: log.info("This was the last row (%s). No turn needed at %s.", row_number, row_back_junction)
+        log.info("--- Row %s Processing Complete ---", row_number)
         return True
 
     def run(self):
-        print("Starting Trolley Controller...")
+        log.info("Starting Trolley Controller...")
         self._running = True
+        self._stop_event.clear()
+        previous_handlers = {}
         try:
+            if hasattr(signal, 'SIGHUP'): previous_handlers[signal.SIGHUP] = signal.signal(signal.SIGHUP, self._handle_sighup) # `kill -HUP` reloads the catalog
+            for signum in (signal.SIGINT, signal.SIGTERM): previous_handlers[signum] = signal.signal(signum, self._handle_stop_signal)
             self.firebase_comm.listen_for_requests(self._handle_new_request_callback)
-            while self._running: time.sleep(0.75)
-        except KeyboardInterrupt: print("\nKeyboardInterrupt received.")
-        finally: self.stop()
+            # Requests are processed here on the main thread, one at a time, in arrival order
+            while not self._stop_event.is_set():
+                queued = self._request_queue.get()
+                if queued is None: break
+                self._busy = True
+                if self._stop_event.is_set(): break # Signalled before we were busy: don't start the trip
+                try: self._process_queued_request(*queued)
+                finally: self._busy = False
+        except KeyboardInterrupt: log.info("KeyboardInterrupt received.")
+        finally:
+            # Default handlers again, so a second Ctrl-C can still kill a hung shutdown
+            for signum, handler in previous_handlers.items(): signal.signal(signum, handler)
+            self._busy = False
+            self.stop()
+
+    def _handle_stop_signal(self, signum, frame):
+        # Ctrl-C / SIGTERM: wake run() so it exits through stop() (SimpleQueue.put is safe to call
+        # from a handler). Mid-trip, abort right away as well, so cleanup() stops the motors
+        # instead of the trip carrying on.
+        self._stop_event.set()
+        self._request_queue.put(None)
+        if self._busy: raise KeyboardInterrupt
+
+    def _handle_sighup(self, signum, frame):
+        # Runs on the main thread, possibly mid-trip: reload in the background instead
+        if not self.firebase_comm: return # Already cleaned up
+        threading.Thread(target=self.firebase_comm.refresh_catalog, name="catalog-refresh", daemon=True).start()
 
     def stop(self):
         if not self._running: return
-        print("Stopping Trolley Controller...")
+        log.info("Stopping Trolley Controller...")
         self._running = False
+        self._stop_event.set()
+        self._request_queue.put(None)
         self.cleanup()
-        print("Trolley Controller stopped.")
+        log.info("Trolley Controller stopped.")
 
     def cleanup(self):
-        print("Cleaning up resources...")
-        if self.hw_interface: self.hw_interface.close()
-        print("Cleanup finished.")
+        # Each resource is dropped once closed, so a second cleanup() is a no-op
+        if not (self.navigator or self.hw_interface or self.firebase_comm): return
+        log.info("Cleaning up resources...")
+        if self.navigator: self.navigator.close(); self.navigator = None
+        if self.hw_interface: self.hw_interface.close(); self.hw_interface = None
+        if self.firebase_comm: self.firebase_comm.close(); self.firebase_comm = None
+        log.info("Cleanup finished.")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._running: self.stop()
+        else: self.cleanup()
 
 # --- Main Execution ---
 if __name__ == "__main__":
+    configure_logging()
     print("------------------------------------")
     print("  Automated Shopping Trolley Ctrl   ")
     print("------------------------------------")
-    controller = None
     try:
-        controller = TrolleyController()
-        controller.run()
+        with TrolleyController() as controller: # Cleans up exactly once, however run() exits
+            controller.run()
     except RuntimeError as e:
-         print(f"Could not start Trolley Controller: {e}")
-         if controller: controller.cleanup()
+         log.error("Trolley Controller failed: %s", e)
     except Exception as e:
-         print(f"An unexpected error occurred in main: {e}")
-         if controller: controller.cleanup()
+         log.error("An unexpected error occurred in main: %s", e)
     finally:
-        print("Exiting application.")
+        log.info("Exiting application.")
         sys.exit(0)
 
@@ -1,12 +1,34 @@
+import time
+from contextlib import contextmanager
+import RPi.GPIO as GPIO
 from mfrc522 import SimpleMFRC522
 
-reader = SimpleMFRC522()
+POLL_INTERVAL = 0.05  # Seconds between reader polls; reader.read() spins on SPI with no pause
+
+
+@contextmanager
+def mfrc522_reader():
+    """SimpleMFRC522 reader whose GPIO pins are released on exit, however the block ends."""
+    reader = SimpleMFRC522()
+    try:
+        yield reader
+    finally:
+        GPIO.cleanup()
+
+
 print("Place your RFID tag near the reader...")
 
 try:
-    id, text = reader.read()
+    with mfrc522_reader() as reader:
+        while True:
+            id, text = reader.read_no_block()
+            if id:
+                break
+            time.sleep(POLL_INTERVAL)
     print(f"RFID Tag ID: {id}")
     print(f"Data on Tag: {text}")
+except KeyboardInterrupt:
+    print("Stopped by user.")
 except Exception as e:
     print(f"Error: {e}")
 finally:
@@ -4,6 +4,8 @@ from firebase_admin import db
 import time
 import serial  # For serial communication
 import lgpio  # For GPIO access
+import threading
+import select
 
 # --- Firebase Configuration ---
 cred = credentials.Certificate("/home/pie/shopping_trolley/serviceAccountKey.json")  # VERIFY PATH!
@@ -18,9 +20,8 @@ h = lgpio.gpiochip_open(0)  # Open the default GPIO chip
 IR_LEFT = 27  # Left IR sensor
 IR_RIGHT = 23 # Right IR sensor
 
-# Set IR sensor pins as inputs
-lgpio.gpio_claim_input(h, IR_LEFT)
-lgpio.gpio_claim_input(h, IR_RIGHT)
+# Set IR sensor pins as inputs, claimed as one group so both are read together
+lgpio.group_claim_input(h, [IR_LEFT, IR_RIGHT])
 
 
 # --- Serial Communication with ESP32 ---
@@ -49,44 +50,61 @@ PRODUCT_ROWS = {
     "pdt7": 3, "pdt8": 3, "pdt9": 3,
 }
 
+# --- Navigation Actions ---
+# Commands sent before line following starts, keyed by (from, to) node kind.
+# Kinds are "home", "RFJ", "RBJ" and "pdt"; pairs not listed need no command.
+NAV_RULES = {
+    ("home", "RFJ"): ('F',),  # Move forward from home
+    ("RFJ", "pdt"): ('R',),   # ALWAYS turn RIGHT from RFJ to products
+    ("RBJ", "RFJ"): ('L',),   # Back from RBJ to an RFJ
+    ("RBJ", "RBJ"): ('F',),   # Go forward from RBJ to RBJ
+    ("RFJ", "RBJ"): ('F',),   # Go forward from RFJ to RBJ
+    ("RFJ", "home"): (),      # Straight home; the main loop drives forward
+    ("pdt", "pdt"): ('F',),   # Go forward from pdt to pdt
+    ("pdt", "RBJ"): ('F',),   # Go forward from pdt to RBJ
+}
+
+def node_kind(node_name):
+    return "home" if node_name == "home" else node_name[:3]
+
+# Expanded once at start-up to every (from, to) node pair
+NAV_ACTIONS = {
+    (src, dst): NAV_RULES[(node_kind(src), node_kind(dst))]
+    for src in NODE_MAPPING for dst in NODE_MAPPING
+    if src != dst and (node_kind(src), node_kind(dst)) in NAV_RULES
+}
+
 # --- Send Command to ESP32 ---
 def send_command(command):
     if esp32:
         print(f"Sending command: {command}")
-        esp32.write(command.encode())
-        esp32.flush()  # Ensure command is sent immediately
+        esp32.write(command.encode())  # Handed to the kernel straight away; no need to wait for the UART to drain
     else:
         print("ESP32 not connected. Cannot send command.")
 
 # --- Read IR Sensors (Raspberry Pi) using lgpio ---
+def read_ir_bits():
+    """Raw group levels in one call: bit 0 = left, bit 1 = right (1 = on black)."""
+    _, bits = lgpio.group_read(h, IR_LEFT)
+    return bits & 0b11
+
 def read_ir_sensors():
-    left_value = lgpio.gpio_read(h, IR_LEFT)
-    right_value = lgpio.gpio_read(h, IR_RIGHT)
+    bits = read_ir_bits()
     # Invert logic if using pull-up resistors and active-low sensors
-    return (not left_value, not right_value)
+    return (not bits & 1, not bits & 2)
 
 # --- Line Following Logic (Simplified for 2 Sensors) ---
+# Indexed by read_ir_bits():
+#   0 - both sensors on white (off the line)
+#   1 - left on black, right on white
+#   2 - right on black, left on white
+#   3 - both sensors on black (centered)
+LINE_STATE = ("LOST", "SLIGHT_RIGHT", "SLIGHT_LEFT", "CENTERED")
+# Command to send for each state (None for LOST, which stops navigation)
+LINE_COMMAND = (None, 'M', 'N', 'F')
+
 def follow_line():
-    left_sensor, right_sensor = read_ir_sensors()
-
-    if left_sensor and right_sensor:
-        # Both sensors on white (off the line) - Stop or search
-        #send_command('S')
-        #print("Lost Line!")
-        return "LOST"  # Indicate line is lost
-    elif not left_sensor and not right_sensor:
-        # Both sensors on black (centered)
-        # send_command('F')  <- REMOVE THIS - No need to send 'F' repeatedly
-        return "CENTERED"
-    elif not left_sensor and right_sensor:
-        # Left sensor on black, right on white - Slight right
-        #send_command('N') #slight right
-        return "SLIGHT_RIGHT"
-    elif left_sensor and not right_sensor:
-        # Right sensor on black, left on white - Slight left
-        #send_command('M') #slight left
-        return "SLIGHT_LEFT"
-    return "OTHER" #Default case
+    return LINE_STATE[read_ir_bits()]
 
 
 # --- Firebase Event Handlers ---
@@ -334,61 +352,30 @@ def navigate_to_node(current_position_name, destination_node_name, request_id):
         print(f"Already at destination: {destination_node_name}")
         return
 
-    # Special cases for initial turns from home node.
-    if current_position_name == "home":
-        if destination_node_name.startswith("RFJ"):
-            send_command('F')  # Move forward from home
-            time.sleep(0.5)   # Adjust timing if necessary.
-
-        else: #If destination is not RFJ
-            print("Error: Can only go to RFJ nodes from home.")
-            status_ref.set("error:invalid_navigation")
-            return
-    if current_position_name.startswith("RFJ") and destination_node_name.startswith("pdt"):
-        send_command('L')  # ALWAYS turn RIGHT from RFJ to products
-        time.sleep(0.5)
-    # Handle navigation between junctions and products.  ALWAYS turn right.
-    if current_position_name.startswith("RFJ") and destination_node_name.startswith("pdt"):
-        send_command('R')  # ALWAYS turn RIGHT from RFJ to products
-        time.sleep(0.5)
-
-    #Going back logic from RBJ to RFJ
-    if current_position_name.startswith("RBJ") and destination_node_name.startswith("RFJ"):
-        if int(current_position_name[-1]) == int(destination_node_name[-1]): #RBJ1 to RFJ1, RBJ2 to RFJ2
-          send_command('L')
-          time.sleep(0.5)
-        else:
-          send_command("L") #Turn left and go to next back junction.
-          time.sleep(0.5)
-    #RBJ to RBJ
-    if current_position_name.startswith("RBJ") and destination_node_name.startswith("RBJ"):
-        send_command('F')  # Go forward from RBJ to RBJ
-        time.sleep(0.5)
-
-    #going from RFJ to RBJ
-    if current_position_name.startswith("RFJ") and destination_node_name.startswith("RBJ"):
-        send_command('F')  # Go forward from RFJ to RBJ
-        time.sleep(0.5)
+    # Only RFJ nodes can be reached directly from home.
+    if current_position_name == "home" and (current_position_name, destination_node_name) not in NAV_ACTIONS:
+        print("Error: Can only go to RFJ nodes from home.")
+        status_ref.set("error:invalid_navigation")
+        return
 
-    #going back home from RFJ, no turns needed, will go straight F
-    if current_position_name.startswith("RFJ") and destination_node_name == "home":
-        # send_command('F')  # Go forward to home <- NO, handled by main loop
-        # time.sleep(0.5)   <- No delay needed, handled by main loop
-        pass # We just let the loop handle the forward movement.
+    for command in NAV_ACTIONS.get((current_position_name, destination_node_name), ()):
+        send_command(command)
+        time.sleep(0.5)   # Adjust timing if necessary.
 
-     #going from pdt to pdt, or pdt to RBJ
-    if current_position_name.startswith("pdt") and (destination_node_name.startswith("pdt") or destination_node_name.startswith("RBJ")):
-        send_command('F')  # Go forward from pdt to pdt or RBJ
-        time.sleep(0.5)
      # --- Initial Forward Command ---
     send_command('F')  # Start moving forward initially.
+    last_command = 'F'
 
     # --- Main Navigation Loop (Line Following and RFID) ---
        # --- Main Navigation Loop (Line Following and RFID) ---
+    next_step = time.monotonic()
     while True:
-        if esp32.in_waiting > 0:
+        # Sleep until the ESP32 sends something or the next line-following step is due
+        readable, _, _ = select.select([esp32.fileno()], [], [], max(0, next_step - time.monotonic()))
+        if readable:
             response = esp32.readline().decode('utf-8').rstrip()
             if response.startswith("RFID:"):
+                last_command = 'S'  # The ESP32 halts on every tag read
                 uid = response[5:]
                 print(f"RFID Detected: {uid}")
                 expected_uid = get_expected_uid(destination_node_name)
@@ -406,22 +393,25 @@ def navigate_to_node(current_position_name, destination_node_name, request_id):
                 else:  # THIS IS THE KEY CHANGE
                     print(f"Incorrect RFID. Expected: {expected_uid}, Got: {uid}")
                     send_command('F')  # Continue moving forward
+                    last_command = 'F'
                     time.sleep(0.1)    # Small delay
 
-        response = follow_line()
-        if response == "LOST":
+            if time.monotonic() < next_step:
+                continue  # Woken early by serial data; keep the line-following cadence
+
+        bits = read_ir_bits()
+        if LINE_STATE[bits] == "LOST":
             send_command('S')
             print("Line Lost")
             return
 
         # --- Line Following Adjustments ---
-        if response == "CENTERED":
-            send_command('F')   # Keep moving forward when centered
-        elif response == "SLIGHT_LEFT":
-            send_command('N')
-        elif response == "SLIGHT_RIGHT":
-            send_command('M')
-        time.sleep(0.05)
+        # Only send when the correction changes; the ESP32 keeps doing the last command
+        command = LINE_COMMAND[bits]
+        if command != last_command:
+            send_command(command)
+            last_command = command
+        next_step = time.monotonic() + 0.05
 
 
 
@@ -472,10 +462,11 @@ if __name__ == "__main__":
 
     print("Trolley controller started. Listening for requests...")
 
+    stop_event = threading.Event()
     try:
-        while True:
-            time.sleep(1)  # Keep the main thread alive
+        stop_event.wait()  # Keep the main thread alive without waking every second
     except KeyboardInterrupt:
         print("Trolley controller stopped.")
     finally:
+        esp32.flush()  # Let any last command finish sending
         lgpio.gpiochip_close(h)  # Clean up lgpio on exit